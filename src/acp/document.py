@@ -2,15 +2,40 @@
 Core ACPDocument class for multi-resolution data representation.
 """
 
+import io
 import json
+import math
+import operator
+import os
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 from typing import Any
 
+from .generators import DEFAULT_GENERATOR
 from .levels import ResolutionLevel
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+# L0 is the same for every document, and so is its token count
+# (one token under cl100k_base and under the fallback approximation)
+_L0_EXISTS = "exists"
+_L0_TOKEN_COUNT = 1
+
+# Only texts up to this length are memoized by _enc_len; L2/L3 dumps are
+# long and rarely repeat, so caching them would just pin large strings
+_MEMO_MAX_CHARS = 256
+
+# Punctuation that the fallback counter treats as extra token boundaries
+_SPECIAL_CHARS = '{}[]():,"\''
+_DROP_SPECIALS = str.maketrans("", "", _SPECIAL_CHARS)
+
+
+@dataclass(slots=True)
 class ACPDocument:
     """
     An ACP document representing an entity at multiple resolution levels.
@@ -32,12 +57,12 @@ class ACPDocument:
     data: dict[str, Any]
 
     # Resolution level representations
-    l0: str = "exists"
+    l0: str = _L0_EXISTS
     l1: str = ""
     l2: dict[str, Any] = field(default_factory=dict)
     l3: dict[str, Any] = field(default_factory=dict)
 
-    # Metadata
+    # Metadata; generated_at is stamped on first serialization if not given
     token_counts: dict[str, int] = field(default_factory=dict)
     generated_at: datetime | None = None
     confidence: float = 1.0
@@ -46,12 +71,17 @@ class ACPDocument:
     key_fields: list[str] = field(default_factory=list)
     summary_template: str | None = None
 
+    # Attribute holding each level, indexed by ResolutionLevel value
+    _LEVEL_NAMES = ("l0", "l1", "l2", "l3")
+
+    # (token_counts key, attribute) pairs that _get_by_budget tries, highest first
+    _BUDGET_LEVELS = (("L3", "l3"), ("L2", "l2"), ("L1", "l1"))
+
     def __post_init__(self):
         """Initialize L3 from data if not set."""
         if not self.l3:
-            self.l3 = self.data.copy()
-        if not self.generated_at:
-            self.generated_at = datetime.now()
+            # L3 is the full data; share it rather than copying
+            self.l3 = self.data
 
     @classmethod
     def from_dict(
@@ -81,7 +111,6 @@ class ACPDocument:
             entity=entity,
             id=id,
             data=data,
-            l3=data.copy(),
             key_fields=key_fields or [],
             summary_template=summary_template,
         )
@@ -91,14 +120,18 @@ class ACPDocument:
 
         return doc
 
-    def generate_levels(self) -> None:
-        """Generate all resolution levels from the source data."""
-        from .generators import SchemaBasedGenerator
+    def generate_levels(self, count_tokens: bool = True) -> None:
+        """
+        Generate all resolution levels from the source data.
 
-        generator = SchemaBasedGenerator()
+        Args:
+            count_tokens: Whether to calculate token counts right away; pass
+                False when counting many documents with calculate_tokens_batch
+        """
+        generator = DEFAULT_GENERATOR
 
         # L0 is always "exists"
-        self.l0 = "exists"
+        self.l0 = _L0_EXISTS
 
         # Generate L1 (summary)
         self.l1 = generator.generate_l1(self.data, self.entity, self.summary_template)
@@ -107,20 +140,64 @@ class ACPDocument:
         self.l2 = generator.generate_l2(self.data, self.entity, self.key_fields)
 
         # L3 is the full data
-        self.l3 = self.data.copy()
+        self.l3 = self.data
 
         # Calculate token counts
-        self._calculate_tokens()
+        if count_tokens:
+            self._calculate_tokens()
+
+    @classmethod
+    def calculate_tokens_batch(cls, docs: list["ACPDocument"]) -> None:
+        """
+        Calculate token counts for many documents at once.
+
+        With tiktoken installed, every level of every document is encoded in
+        a single multi-threaded encode_batch call.
+
+        Example:
+            >>> docs = [ACPDocument.from_dict(d, "user", d["id"], auto_generate=False)
+            ...         for d in rows]
+            >>> for doc in docs:
+            ...     doc.generate_levels(count_tokens=False)
+            >>> ACPDocument.calculate_tokens_batch(docs)
+        """
+        enc = _get_encoder()
+        if enc is None:
+            for doc in docs:
+                doc._calculate_tokens()
+            return
+
+        texts = [text for doc in docs for text in doc._level_texts()[1:]]
+        encoded = enc.encode_batch(texts, num_threads=os.cpu_count() or 1)
+        for i, doc in enumerate(docs):
+            l1, l2, l3 = encoded[3 * i:3 * i + 3]
+            doc.token_counts = {
+                "L0": _count_l0_tokens(doc.l0),
+                "L1": len(l1),
+                "L2": len(l2),
+                "L3": len(l3),
+            }
+
+    def _level_texts(self) -> tuple[str, str, str, str]:
+        """Return the L0-L3 text that token counts are measured on."""
+        return self.l0, self.l1, _dumps(self.l2), _dumps(self.l3)
 
     def _calculate_tokens(self) -> None:
         """Calculate approximate token counts for each level."""
+        l0, l1, l2, l3 = self._level_texts()
         self.token_counts = {
-            "L0": _count_tokens(self.l0),
-            "L1": _count_tokens(self.l1),
-            "L2": _count_tokens(json.dumps(self.l2)),
-            "L3": _count_tokens(json.dumps(self.l3)),
+            "L0": _count_l0_tokens(l0),
+            "L1": _count_tokens(l1),
+            "L2": _count_tokens(l2),
+            "L3": _count_tokens(l3),
         }
 
+    def _generated_at_str(self) -> str:
+        """Return generated_at in ISO format, stamping it on first use."""
+        if self.generated_at is None:
+            self.generated_at = datetime.now()
+        return self.generated_at.isoformat()
+
     def get(
         self,
         level: ResolutionLevel | int | None = None,
@@ -149,29 +226,23 @@ class ACPDocument:
 
     def _get_level(self, level: ResolutionLevel | int) -> Any:
         """Get data at specific level."""
-        if isinstance(level, int):
-            level = ResolutionLevel(level)
-
-        if level == ResolutionLevel.L0_EXISTENCE:
-            return self.l0
-        elif level == ResolutionLevel.L1_SUMMARY:
-            return self.l1
-        elif level == ResolutionLevel.L2_KEY_FACTS:
-            return self.l2
-        elif level == ResolutionLevel.L3_FULL:
-            return self.l3
-        else:
-            raise ValueError(f"Unknown level: {level}")
+        try:
+            # Accepts ints and ResolutionLevel, but not floats or strings
+            idx = operator.index(level)
+        except TypeError:
+            raise ValueError(f"Unknown level: {level}") from None
+        if 0 <= idx < len(self._LEVEL_NAMES):
+            return getattr(self, self._LEVEL_NAMES[idx])
+        raise ValueError(f"Unknown level: {level}")
 
     def _get_by_budget(self, budget: int) -> Any:
         """Get highest resolution level that fits within token budget."""
         # Check levels from highest to lowest
-        if self.token_counts.get("L3", float("inf")) <= budget:
-            return self.l3
-        if self.token_counts.get("L2", float("inf")) <= budget:
-            return self.l2
-        if self.token_counts.get("L1", float("inf")) <= budget:
-            return self.l1
+        counts = self.token_counts
+        for key, name in self._BUDGET_LEVELS:
+            tokens = counts.get(key)
+            if tokens is not None and tokens <= budget:
+                return getattr(self, name)
         return self.l0
 
     def to_acp_format(self, level: ResolutionLevel | None = None) -> str:
@@ -184,47 +255,38 @@ class ACPDocument:
         Returns:
             ACP-formatted string
         """
-        lines = [
-            "@acp 1.0",
-            f"@entity: {self.entity}",
-            f"@id: {self.id}",
-            "",
-        ]
+        buf = io.StringIO()
+        w = buf.write
+        w(f"@acp 1.0\n@entity: {self.entity}\n@id: {self.id}\n\n")
 
         if level is None or level == ResolutionLevel.L0_EXISTENCE:
-            lines.append(f"L0: {self.l0}")
-            lines.append("")
+            w(f"L0: {self.l0}\n\n")
 
         if level is None or level == ResolutionLevel.L1_SUMMARY:
-            lines.append(f'L1: "{self.l1}"')
-            lines.append("")
+            w(f'L1: "{self.l1}"\n\n')
 
         if level is None or level == ResolutionLevel.L2_KEY_FACTS:
-            lines.append("L2:")
+            w("L2:\n")
             for k, v in self.l2.items():
-                lines.append(f"  {k}: {v}")
-            lines.append("")
+                w(f"  {k}: {v}\n")
+            w("\n")
 
         if level is None or level == ResolutionLevel.L3_FULL:
-            lines.append("L3:")
-            for line in json.dumps(self.l3, indent=2).split("\n"):
-                lines.append(f"  {line}")
-            lines.append("")
+            w("L3:\n  ")
+            w(_nest(_dumps(self.l3, indent=2), 2))
+            w("\n\n")
 
         # Metadata
-        lines.append("@meta:")
-        lines.append(f"  tokens: {self.token_counts}")
-        if self.generated_at:
-            lines.append(f"  generated: {self.generated_at.isoformat()}")
+        w(f"@meta:\n  tokens: {self.token_counts}\n  generated: {self._generated_at_str()}")
 
-        return "\n".join(lines)
+        return buf.getvalue()
 
     def to_json(self, level: ResolutionLevel | None = None) -> str:
         """Serialize to JSON format."""
         if level is not None:
-            return json.dumps(self.get(level=level), indent=2)
+            return _dumps(self.get(level=level), indent=2)
 
-        return json.dumps({
+        return _dumps({
             "acp_version": "1.0",
             "entity": self.entity,
             "id": self.id,
@@ -236,7 +298,7 @@ class ACPDocument:
             },
             "meta": {
                 "tokens": self.token_counts,
-                "generated": self.generated_at.isoformat() if self.generated_at else None,
+                "generated": self._generated_at_str(),
             }
         }, indent=2)
 
@@ -244,17 +306,142 @@ class ACPDocument:
         return f"ACPDocument(entity={self.entity!r}, id={self.id!r}, tokens={self.token_counts})"
 
 
+def _dumps(obj: Any, indent: int | None = None) -> str:
+    """
+    Serialize to JSON, preferring orjson when it is installed.
+
+    orjson only supports two-space indentation, which is all ACP uses.
+    It also writes NaN and Infinity as null, so payloads holding those
+    go through json, which keeps them.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            out = orjson.dumps(obj, option=option)
+        except TypeError:
+            # e.g. integers wider than 64 bits; let json have the final say
+            pass
+        else:
+            # Non-finite floats can only be behind a null in the output
+            if b"null" not in out or not _has_non_finite(obj):
+                return out.decode()
+    return json.dumps(obj, indent=indent)
+
+
+def _has_non_finite(obj: Any) -> bool:
+    """Whether a JSON-like structure contains a NaN or infinite float."""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+            stack.extend(k for k in value if isinstance(k, float))
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def _nest(text: str, indent: int) -> str:
+    """Re-indent a standalone JSON dump for embedding at a nesting depth."""
+    return text.replace("\n", "\n" + " " * indent)
+
+
+@lru_cache(maxsize=1)
+def _get_encoder() -> Any:
+    """Return the shared cl100k_base encoder, or None without tiktoken."""
+    # tiktoken is optional and slow to import, so load it on first use
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4096)
+def _enc_len(text: str) -> int:
+    """Count tokens with tiktoken, memoized on the text itself (short texts only)."""
+    return len(_get_encoder().encode(text))
+
+
+def _count_l0_tokens(text: str) -> int:
+    """Count L0 tokens, skipping the tokenizer for the standard value."""
+    if text == _L0_EXISTS:
+        return _L0_TOKEN_COUNT
+    return _count_tokens(text)
+
+
 def _count_tokens(text: str) -> int:
     """
     Count tokens in text.
 
     Uses tiktoken if available, otherwise approximates.
     """
-    try:
-        import tiktoken
-        enc = tiktoken.get_encoding("cl100k_base")
+    enc = _get_encoder()
+    if enc is not None:
+        if len(text) <= _MEMO_MAX_CHARS:
+            return _enc_len(text)
         return len(enc.encode(text))
+
+    # Approximate: ~4 chars per token + special chars
+    special = _get_special_counter()(text)
+    return len(text) // 4 + special // 2
+
+
+@lru_cache(maxsize=1)
+def _get_special_counter() -> Callable[[str], int]:
+    """
+    Return the fastest available counter for _SPECIAL_CHARS in a string.
+
+    Prefers a Numba kernel, then a NumPy lookup table, then str.translate.
+    Both libraries are optional and slow to import, so they are loaded on
+    the first fallback count rather than at import time.
+    """
+    try:
+        import numpy as np
     except ImportError:
-        # Approximate: ~4 chars per token + special chars
-        special = sum(1 for c in text if c in '{}[]():,"\'')
-        return len(text) // 4 + special // 2
+        return _count_special_translate
+
+    try:
+        from numba import njit
+    except ImportError:
+        table = np.zeros(256, dtype=bool)
+        table[[ord(c) for c in _SPECIAL_CHARS]] = True
+
+        def count_with_table(text: str) -> int:
+            return int(np.count_nonzero(table[_utf8_buffer(np, text)]))
+
+        return count_with_table
+
+    kernel = njit(cache=True)(_count_special_bytes)
+
+    def count_with_kernel(text: str) -> int:
+        return kernel(_utf8_buffer(np, text))
+
+    return count_with_kernel
+
+
+def _utf8_buffer(np: Any, text: str) -> Any:
+    """View text as a uint8 array; specials are all ASCII, so counts stay exact."""
+    return np.frombuffer(text.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+
+
+def _count_special_bytes(buf: Any) -> int:
+    """Count bytes of _SPECIAL_CHARS in a uint8 buffer (compiled with Numba)."""
+    count = 0
+    for b in buf:
+        # { } [ ] ( ) : , " '
+        if (b == 123 or b == 125 or b == 91 or b == 93 or b == 40
+                or b == 41 or b == 58 or b == 44 or b == 34 or b == 39):
+            count += 1
+    return count
+
+
+def _count_special_translate(text: str) -> int:
+    """Count _SPECIAL_CHARS in text without NumPy."""
+    # str.translate scans in C; the length drop is the special count
+    return len(text) - len(text.translate(_DROP_SPECIALS))
@@ -3,8 +3,49 @@ Level generators for automatically creating ACP resolution levels.
 """
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
+from string import Formatter
 from typing import Any
 
+# Keys that best represent a nested dict in L2, in order of preference
+_PREF_KEYS = ("name", "id", "value")
+
+_MISSING = object()
+
+# Fields whose presence keeps an ID out of a summary
+_NAME_KEYS = ("name", "title")
+
+
+@lru_cache(maxsize=256)
+def _template_fields(template: str) -> tuple[str, ...]:
+    """Return the top-level names referenced by a str.format template."""
+    names = []
+    for _, field_name, _, _ in Formatter().parse(template):
+        if field_name:
+            # "author.name" and "skills[0]" both look up their root first
+            names.append(field_name.split(".", 1)[0].split("[", 1)[0])
+    return tuple(names)
+
+
+def _shadowed(data: dict[str, Any], names: tuple[str, ...]) -> bool:
+    """
+    Whether flattening data could give any of names a nested value.
+
+    _flatten_data stores nested values under both their prefixed and bare
+    keys, so a plain top-level lookup only agrees with it when no nested
+    key matches one of names.
+    """
+    stack = [(key, value) for key, value in data.items() if isinstance(value, dict)]
+    while stack:
+        prefix, nested = stack.pop()
+        for key, value in nested.items():
+            full_key = f"{prefix}_{key}" if prefix else key
+            if key in names or full_key in names:
+                return True
+            if isinstance(value, dict):
+                stack.append((full_key, value))
+    return False
+
 
 class LevelGenerator(ABC):
     """Base class for ACP level generators."""
@@ -38,11 +79,12 @@ class SchemaBasedGenerator(LevelGenerator):
     determine which fields are important for L1/L2.
     """
 
-    # Common field names that are typically important
-    HIGH_PRIORITY_FIELDS = {
-        "id", "name", "title", "status", "type", "role",
+    # Common field names that are typically important, most telling first
+    HIGH_PRIORITY_ORDER = (
+        "name", "title", "id", "status", "type", "role",
         "email", "category", "price", "total", "state",
-    }
+    )
+    HIGH_PRIORITY_FIELDS = set(HIGH_PRIORITY_ORDER)
 
     MEDIUM_PRIORITY_FIELDS = {
         "description", "summary", "created_at", "updated_at",
@@ -59,12 +101,12 @@ class SchemaBasedGenerator(LevelGenerator):
 
     # Entity-specific key fields
     ENTITY_KEY_FIELDS = {
-        "user": ["name", "role", "department", "status", "email"],
-        "product": ["name", "category", "price", "in_stock", "rating"],
-        "order": ["id", "status", "total", "user_id", "payment_status"],
-        "article": ["title", "author", "topic", "status", "word_count"],
-        "document": ["title", "type", "author", "status"],
-        "transaction": ["id", "type", "amount", "status", "timestamp"],
+        "user": ("name", "role", "department", "status", "email"),
+        "product": ("name", "category", "price", "in_stock", "rating"),
+        "order": ("id", "status", "total", "user_id", "payment_status"),
+        "article": ("title", "author", "topic", "status", "word_count"),
+        "document": ("title", "type", "author", "status"),
+        "transaction": ("id", "type", "amount", "status", "timestamp"),
     }
 
     def generate_l1(
@@ -92,25 +134,47 @@ class SchemaBasedGenerator(LevelGenerator):
 
     def _apply_template(self, data: dict[str, Any], template: str) -> str:
         """Apply a template string to data."""
+        # Only look at the fields the template uses; flatten when one of
+        # them isn't a plain top-level value or a nested key could shadow it
+        names = _template_fields(template)
+        if all(
+            name in data and not isinstance(data[name], dict) for name in names
+        ) and not _shadowed(data, names):
+            try:
+                return template.format_map({name: data[name] for name in names})
+            except KeyError:
+                pass
+
+        flat = self._flatten_data(data)
         try:
-            return template.format(**self._flatten_data(data))
+            return template.format_map(flat)
         except KeyError:
             # Fall back to simple substitution
             result = template
-            for key, value in self._flatten_data(data).items():
+            for key, value in flat.items():
                 result = result.replace("{" + key + "}", str(value))
             return result
 
     def _auto_summary(self, data: dict[str, Any], entity_type: str) -> str:
         """Automatically generate a summary based on entity type."""
+        summary = self._auto_summary_fast(data, entity_type)
+        if summary is not None:
+            return summary
+
         flat = self._flatten_data(data)
 
         # Get the most important fields for this entity type
-        if entity_type in self.ENTITY_KEY_FIELDS:
-            priority_fields = self.ENTITY_KEY_FIELDS[entity_type][:4]
+        entity_fields = self.ENTITY_KEY_FIELDS.get(entity_type)
+        if entity_fields is not None:
+            priority_fields = entity_fields[:4]
         else:
-            # Use generic high-priority fields
-            priority_fields = [f for f in self.HIGH_PRIORITY_FIELDS if f in flat][:4]
+            # Use generic high-priority fields, in a stable order
+            priority_fields = []
+            for field in self.HIGH_PRIORITY_ORDER:
+                if field in flat:
+                    priority_fields.append(field)
+                    if len(priority_fields) == 4:
+                        break
 
         # Build summary from available fields
         parts = []
@@ -130,6 +194,43 @@ class SchemaBasedGenerator(LevelGenerator):
 
         return ", ".join(parts) if parts else f"{entity_type} entity"
 
+    def _auto_summary_fast(self, data: dict[str, Any], entity_type: str) -> str | None:
+        """
+        Summarize a known entity type from its top-level fields only.
+
+        Returns None when a priority field is missing, nested, or could be
+        shadowed by a nested key, so the caller falls back to flattening
+        the whole structure and gets the same precedence either way.
+        """
+        entity_fields = self.ENTITY_KEY_FIELDS.get(entity_type)
+        if entity_fields is None:
+            return None
+
+        priority_fields = entity_fields[:4]
+        parts = []
+        for field in priority_fields:
+            value = data.get(field, _MISSING)
+            if value is _MISSING or isinstance(value, dict):
+                return None
+            if not value:
+                continue
+            if field == "id":
+                # Only a plain value lands in the flattened view under its own
+                # key; a dict name or title might still leave the ID in
+                if any(
+                    not isinstance(data.get(key, {}), dict) for key in _NAME_KEYS
+                ):
+                    continue
+                return None
+            parts.append(str(value))
+
+        if not parts:
+            return None
+        checked = priority_fields + _NAME_KEYS if "id" in priority_fields else priority_fields
+        if _shadowed(data, checked):
+            return None
+        return ", ".join(parts)
+
     def generate_l2(
         self,
         data: dict[str, Any],
@@ -179,8 +280,9 @@ class SchemaBasedGenerator(LevelGenerator):
         result = {}
 
         # Use entity-specific fields if available
-        if entity_type in self.ENTITY_KEY_FIELDS:
-            for field in self.ENTITY_KEY_FIELDS[entity_type]:
+        entity_fields = self.ENTITY_KEY_FIELDS.get(entity_type)
+        if entity_fields is not None:
+            for field in entity_fields:
                 if field in data:
                     result[field] = self._simplify_value(data[field])
                 # Check for nested fields
@@ -208,17 +310,13 @@ class SchemaBasedGenerator(LevelGenerator):
         """Simplify a value for L2 representation."""
         if isinstance(value, dict):
             # For nested dicts, try to get a representative value
-            if "name" in value:
-                return value["name"]
-            if "id" in value:
-                return value["id"]
-            if "value" in value:
-                return value["value"]
-            # Return first string value
-            for v in value.values():
-                if isinstance(v, str):
+            for key in _PREF_KEYS:
+                v = value.get(key, _MISSING)
+                if v is not _MISSING:
                     return v
-            return str(value)
+            # Return first string value
+            first = next((v for v in value.values() if isinstance(v, str)), None)
+            return first if first is not None else str(value)
         elif isinstance(value, list):
             # For lists, return count or first few items
             if len(value) == 0:
@@ -228,18 +326,25 @@ class SchemaBasedGenerator(LevelGenerator):
             return f"[{len(value)} items]"
         return value
 
-    def _flatten_data(self, data: dict[str, Any], prefix: str = "") -> dict[str, Any]:
+    def _flatten_data(self, data: dict[str, Any]) -> dict[str, Any]:
         """Flatten nested data structure."""
-        result = {}
-        for key, value in data.items():
-            full_key = f"{prefix}_{key}" if prefix else key
-            if isinstance(value, dict):
-                result.update(self._flatten_data(value, full_key))
-            else:
+        # Depth-first walk with an explicit stack of item iterators, so keys
+        # land in the same order (and overwrite the same way) as recursion
+        result: dict[str, Any] = {}
+        stack = [("", iter(data.items()))]
+        while stack:
+            prefix, items = stack[-1]
+            for key, value in items:
+                full_key = f"{prefix}_{key}" if prefix else key
+                if isinstance(value, dict):
+                    stack.append((full_key, iter(value.items())))
+                    break
                 result[full_key] = value
                 # Also store without prefix for easy access
                 if prefix:
                     result[key] = value
+            else:
+                stack.pop()
         return result
 
     def _get_nested(self, data: dict[str, Any], path: str) -> Any:
@@ -254,6 +359,10 @@ class SchemaBasedGenerator(LevelGenerator):
         return value
 
 
+# Shared instance used by ACPDocument.generate_levels
+DEFAULT_GENERATOR = SchemaBasedGenerator()
+
+
 class LLMAssistedGenerator(LevelGenerator):
     """
     Generate resolution levels using an LLM for better summaries.
@@ -281,7 +390,7 @@ class LLMAssistedGenerator(LevelGenerator):
     ) -> str:
         """Generate L1 using LLM for natural language summary."""
         if template:
-            return self._fallback._apply_template(data, template)
+            return self._fallback.generate_l1(data, entity_type, template)
 
         if not self.client:
             return self._fallback.generate_l1(data, entity_type, template)
@@ -2,13 +2,38 @@
 MCP Server integration for serving ACP documents.
 """
 
-from collections.abc import Callable
-from functools import wraps
+import asyncio
+import copy
+import inspect
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, MutableMapping
+from functools import partial, update_wrapper, wraps
+from types import MethodType
 from typing import Any
 
-from ..document import ACPDocument
+from ..document import _L0_EXISTS, ACPDocument
 from ..levels import ResolutionLevel
 
+# ASGI interface types, spelled out so Starlette isn't needed at import time
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+# ACP header names as they appear in an ASGI scope (lowercased bytes)
+_ACP_LEVEL = b"acp-level"
+_ACP_BUDGET = b"acp-budget"
+# Longer values aren't plausible levels or budgets and are ignored
+_MAX_HEADER_DIGITS = 9
+
+_MISSING = object()
+
+# Level returned when a request names neither a level nor a budget
+_DEFAULT_LEVEL = ResolutionLevel.L2_KEY_FACTS
+
 
 def acp_resource(
     entity: str,
@@ -28,23 +53,119 @@ def acp_resource(
         key_fields: Fields to include in L2
         summary_template: Template for L1 summary
     """
+    build = partial(
+        ACPDocument.from_dict,
+        entity=entity,
+        key_fields=key_fields,
+        summary_template=summary_template,
+    )
+
     def decorator(func: Callable[..., dict]) -> Callable[..., ACPDocument]:
-        @wraps(func)
-        def wrapper(*args, **kwargs) -> ACPDocument:
-            data = func(*args, **kwargs)
+        wrapper = _specialized_wrapper(func, build)
+        if wrapper is not None:
+            return wraps(func)(wrapper)
+        return _ACPResource(func, build)
+    return decorator
 
-            # Extract ID from data or use first arg
-            entity_id = data.get("id", str(args[0]) if args else "unknown")
 
-            return ACPDocument.from_dict(
-                data=data,
-                entity=entity,
-                id=entity_id,
-                key_fields=key_fields,
-                summary_template=summary_template,
-            )
-        return wrapper
-    return decorator
+class _ACPResource:
+    """Callable returned by acp_resource for handlers of any signature."""
+
+    def __init__(self, func: Callable[..., dict], build: Callable[..., ACPDocument]):
+        self._func = func
+        self._build = build
+        update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs) -> ACPDocument:
+        data = self._func(*args, **kwargs)
+
+        # Extract ID from data or use first arg
+        entity_id = data.get("id", str(args[0]) if args else "unknown")
+
+        return self._build(data=data, id=entity_id)
+
+    def __get__(self, obj: Any, objtype: type | None = None) -> Any:
+        # Bind like a function so decorated methods still receive self
+        if obj is None:
+            return self
+        return MethodType(self, obj)
+
+
+# Names used inside generated wrappers; handlers using them get the generic one
+_WRAPPER_NAMES = frozenset({"_acp_func", "_acp_build", "_acp_data", "_acp_str",
+                            "_acp_arg", "_acp_missing"})
+
+
+def _specialized_wrapper(
+    func: Callable[..., dict],
+    build: Callable[..., ACPDocument],
+) -> Callable[..., ACPDocument] | None:
+    """
+    Compile a wrapper matching a single-argument handler's signature.
+
+    Handlers like get_user(user_id) are the common case; a wrapper taking
+    the argument positionally or by its own name avoids packing *args and
+    **kwargs on every call. As with the generic wrapper, only a positional
+    argument stands in for a missing "id" in the data.
+    Returns None for any other signature.
+    """
+    name = _single_param_name(func)
+    if name is None or name in _WRAPPER_NAMES:
+        return None
+
+    source = (
+        f"def wrapper(_acp_arg=_acp_missing, /, *, {name}=_acp_missing):\n"
+        f"    if _acp_arg is _acp_missing:\n"
+        f"        _acp_data = _acp_func() if {name} is _acp_missing else _acp_func({name}={name})\n"
+        f"        return _acp_build(data=_acp_data, id=_acp_data.get('id', 'unknown'))\n"
+        f"    if {name} is _acp_missing:\n"
+        f"        _acp_data = _acp_func(_acp_arg)\n"
+        f"    else:\n"
+        f"        _acp_data = _acp_func(_acp_arg, {name}={name})\n"
+        f"    return _acp_build(data=_acp_data, id=_acp_data.get('id', _acp_str(_acp_arg)))\n"
+    )
+    namespace = {
+        "_acp_func": func,
+        "_acp_build": build,
+        "_acp_str": str,
+        "_acp_missing": _MISSING,
+    }
+    exec(source, namespace)
+    return namespace["wrapper"]
+
+
+def _single_param_name(func: Callable) -> str | None:
+    """Return the parameter name if func takes exactly one required argument."""
+    try:
+        # A decorator's wrapper may take a different signature than the
+        # function it wraps, and the wrapper is what actually gets called
+        params = list(inspect.signature(func, follow_wrapped=False).parameters.values())
+    except (TypeError, ValueError):
+        return None
+    if len(params) != 1:
+        return None
+    param = params[0]
+    if (
+        param.kind is not inspect.Parameter.POSITIONAL_OR_KEYWORD
+        or param.default is not inspect.Parameter.empty
+    ):
+        return None
+    return param.name
+
+
+def _id_extractor(
+    id_field: str,
+    id_from_params: str | None,
+) -> Callable[[dict, dict[str, Any]], Any]:
+    """Build the function ACPServer uses to pick an entity's ID."""
+    if id_from_params is not None:
+        def from_params(data: dict, params: dict[str, Any]) -> Any:
+            return params[id_from_params]
+        return from_params
+
+    def from_data(data: dict, params: dict[str, Any]) -> Any:
+        return data.get(id_field, params.get("id", "unknown"))
+    return from_data
 
 
 class ACPServer:
@@ -54,6 +175,14 @@ class ACPServer:
     This provides a middleware layer that automatically handles
     ACP resolution levels based on request headers.
 
+    Pass cache_size to keep up to that many built documents in an LRU
+    cache keyed on the entity and request params, so repeat requests for
+    other levels of the same resource don't call the handler again.
+    Cached documents never expire; call invalidate() when the underlying
+    data changes. While caching is on, handle_request returns copies of
+    dict levels so callers can't alter what later requests see. Caching
+    is off by default.
+
     Usage:
         server = ACPServer()
 
@@ -69,26 +198,69 @@ class ACPServer:
         )
     """
 
-    def __init__(self):
+    def __init__(self, cache_size: int = 0):
         self._resources: dict[str, Callable] = {}
         self._entity_configs: dict[str, dict] = {}
+        self._builders: dict[str, Callable[..., ACPDocument]] = {}
+        self._id_extractors: dict[str, Callable[[dict, dict[str, Any]], Any]] = {}
+        self._cache_size = cache_size
+        self._doc_cache: OrderedDict[tuple, ACPDocument] = OrderedDict()
+        # Sync endpoints may share the server across a threadpool
+        self._cache_lock = threading.Lock()
 
     def resource(
         self,
         entity: str,
         key_fields: list[str] | None = None,
         summary_template: str | None = None,
+        id_field: str = "id",
+        id_from_params: str | None = None,
     ):
-        """Register a resource handler."""
+        """
+        Register a resource handler.
+
+        Args:
+            entity: Entity type name
+            key_fields: Fields to include in L2
+            summary_template: Template for L1 summary
+            id_field: Field of the handler's data holding the entity ID
+            id_from_params: Request param that always holds the entity ID;
+                when set, the data is not consulted
+        """
+        # Interned keys let lookups with literal or interned entity names
+        # match by identity before comparing characters
+        entity = sys.intern(entity)
+
         def decorator(func: Callable[..., dict]) -> Callable[..., dict]:
             self._resources[entity] = func
             self._entity_configs[entity] = {
                 "key_fields": key_fields,
                 "summary_template": summary_template,
+                # Lets single-argument handlers skip re-packing **params
+                "positional_name": _single_param_name(func),
+                "is_async": inspect.iscoroutinefunction(func),
             }
+            # Bind the per-entity config once instead of on every request
+            self._builders[entity] = partial(
+                ACPDocument.from_dict,
+                entity=entity,
+                key_fields=key_fields,
+                summary_template=summary_template,
+            )
+            self._id_extractors[entity] = _id_extractor(id_field, id_from_params)
+            self.invalidate(entity)
             return func
         return decorator
 
+    def invalidate(self, entity: str | None = None) -> None:
+        """Drop cached documents for one entity, or for all entities."""
+        with self._cache_lock:
+            if entity is None:
+                self._doc_cache.clear()
+                return
+            for key in [key for key in self._doc_cache if key[0] == entity]:
+                del self._doc_cache[key]
+
     def handle_request(
         self,
         entity: str,
@@ -100,84 +272,221 @@ class ACPServer:
         Handle a request and return data at appropriate resolution.
 
         Args:
-            entity: Entity type to fetch
+            entity: Entity type to fetch; names built at runtime (e.g. parsed
+                from JSON) look up fastest when passed through sys.intern
             params: Parameters to pass to the resource handler
             level: Specific resolution level requested
             token_budget: Maximum tokens for response
 
         Returns:
             Data at the requested resolution level
+
+        An explicit L0 request returns "exists" without calling the handler,
+        so it only checks that the entity type is registered, not that the
+        requested record is in the backing store.
         """
-        if entity not in self._resources:
-            raise ValueError(f"Unknown entity type: {entity}")
+        if self._wants_l0(entity, level):
+            return _L0_EXISTS
 
-        # Get raw data from handler
-        handler = self._resources[entity]
-        data = handler(**params)
-
-        # Get entity ID
-        entity_id = data.get("id", params.get("id", "unknown"))
-
-        # Create ACP document
-        config = self._entity_configs.get(entity, {})
-        doc = ACPDocument.from_dict(
-            data=data,
-            entity=entity,
-            id=entity_id,
-            key_fields=config.get("key_fields"),
-            summary_template=config.get("summary_template"),
-        )
+        doc = self.get_document(entity, params)
+        return self._resolve(doc, level, token_budget)
 
-        # Return at requested resolution
-        if level is not None:
-            return doc.get(level=level)
-        if token_budget is not None:
-            return doc.get(token_budget=token_budget)
+    async def handle_requests(
+        self,
+        requests: list[tuple[str, dict[str, Any], ResolutionLevel | None, int | None]],
+    ) -> list[Any]:
+        """
+        Handle several requests concurrently.
+
+        Async handlers are awaited directly; sync handlers run in the
+        event loop's default executor, so independent fetches overlap.
 
-        # Default to L2 for reasonable balance
-        return doc.get(level=ResolutionLevel.L2_KEY_FACTS)
+        Args:
+            requests: (entity, params, level, token_budget) tuples, with the
+                same meaning as the handle_request arguments
+
+        Returns:
+            Results in the same order as the requests
+        """
+        return list(await asyncio.gather(*(self._handle_async(*req) for req in requests)))
+
+    async def _handle_async(
+        self,
+        entity: str,
+        params: dict[str, Any],
+        level: ResolutionLevel | None = None,
+        token_budget: int | None = None,
+    ) -> Any:
+        """Async counterpart of handle_request used by handle_requests."""
+        if self._wants_l0(entity, level):
+            return _L0_EXISTS
+
+        handler = self._lookup(entity)
+        key = self._cache_key(entity, params)
+        doc = self._cache_get(key)
+        if doc is None:
+            if self._entity_configs[entity]["is_async"]:
+                data = await handler(**params)
+            else:
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(
+                    None, partial(self._call_handler, entity, handler, params)
+                )
+            doc = self._build(key, entity, params, data)
+        return self._resolve(doc, level, token_budget)
 
     def get_document(self, entity: str, params: dict[str, Any]) -> ACPDocument:
-        """Get the full ACP document for an entity."""
-        if entity not in self._resources:
+        """
+        Get the full ACP document for an entity.
+
+        With caching enabled the returned document is shared with later
+        requests and should be treated as read-only.
+        """
+        handler = self._lookup(entity)
+        key = self._cache_key(entity, params)
+        doc = self._cache_get(key)
+        if doc is None:
+            data = self._call_handler(entity, handler, params)
+            doc = self._build(key, entity, params, data)
+        return doc
+
+    def _lookup(self, entity: str) -> Callable:
+        """Return the handler for entity, or raise ValueError."""
+        handler = self._resources.get(entity, _MISSING)
+        if handler is _MISSING:
             raise ValueError(f"Unknown entity type: {entity}")
+        return handler
 
-        handler = self._resources[entity]
-        data = handler(**params)
-        entity_id = data.get("id", params.get("id", "unknown"))
-
-        config = self._entity_configs.get(entity, {})
-        return ACPDocument.from_dict(
-            data=data,
-            entity=entity,
-            id=entity_id,
-            key_fields=config.get("key_fields"),
-            summary_template=config.get("summary_template"),
-        )
+    def _wants_l0(self, entity: str, level: ResolutionLevel | None) -> bool:
+        """Whether a request explicitly asks for L0, which needs no data."""
+        # Budgets always build the document: even tiny ones may fit L1
+        wants_l0 = level is not None and level == ResolutionLevel.L0_EXISTENCE
+        if wants_l0 and entity not in self._resources:
+            raise ValueError(f"Unknown entity type: {entity}")
+        return wants_l0
+
+    def _resolve(
+        self,
+        doc: ACPDocument,
+        level: ResolutionLevel | None,
+        token_budget: int | None,
+    ) -> Any:
+        """Return doc at the requested resolution."""
+        if level is not None:
+            result = doc.get(level=level)
+        elif token_budget is not None:
+            result = doc.get(token_budget=token_budget)
+        else:
+            # Default to L2 for reasonable balance
+            result = doc.get(level=_DEFAULT_LEVEL)
+
+        if self._cache_size > 0 and isinstance(result, dict):
+            # Cached documents serve later requests too; hand out a copy
+            return copy.deepcopy(result)
+        return result
+
+    def _cache_key(self, entity: str, params: dict[str, Any]) -> tuple | None:
+        """Return the document cache key for a request, or None if uncacheable."""
+        if self._cache_size <= 0:
+            return None
+        key = (entity, tuple(sorted(params.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable params can't be cached; build every time
+            return None
+        return key
+
+    def _cache_get(self, key: tuple | None) -> ACPDocument | None:
+        """Return a cached document and mark it most recently used."""
+        if key is None:
+            return None
+        with self._cache_lock:
+            doc = self._doc_cache.get(key)
+            if doc is not None:
+                self._doc_cache.move_to_end(key)
+        return doc
+
+    def _call_handler(self, entity: str, handler: Callable, params: dict[str, Any]) -> dict:
+        """Call a sync handler, passing a lone matching param positionally."""
+        name = self._entity_configs[entity]["positional_name"]
+        if name is not None and len(params) == 1 and name in params:
+            return handler(params[name])
+        return handler(**params)
+
+    def _build(
+        self,
+        key: tuple | None,
+        entity: str,
+        params: dict[str, Any],
+        data: dict,
+    ) -> ACPDocument:
+        """Build a document from handler data and cache it under key."""
+        entity_id = self._id_extractors[entity](data, params)
+        doc = self._builders[entity](data=data, id=entity_id)
 
+        if key is not None:
+            with self._cache_lock:
+                self._doc_cache[key] = doc
+                if len(self._doc_cache) > self._cache_size:
+                    self._doc_cache.popitem(last=False)
+        return doc
 
-# FastAPI middleware (if FastAPI is available)
-def create_fastapi_middleware():
+
+class ACPHeaderMiddleware:
     """
-    Create FastAPI middleware for ACP support.
+    ASGI middleware for ACP support.
+
+    Reads the ACP-Level and ACP-Budget headers straight from the ASGI scope
+    and stores them in the request state, so handlers can use
+    request.state.acp_level and request.state.acp_budget.
 
     Usage:
         from fastapi import FastAPI
-        from acp.mcp.server import create_fastapi_middleware
+        from acp.mcp.server import ACPHeaderMiddleware
 
         app = FastAPI()
-        app.middleware("http")(create_fastapi_middleware())
+        app.add_middleware(ACPHeaderMiddleware)
     """
-    async def acp_middleware(request, call_next):
-        # Check for ACP headers
-        acp_level = request.headers.get("ACP-Level")
-        acp_budget = request.headers.get("ACP-Budget")
-
-        # Store in request state for handlers to use
-        request.state.acp_level = int(acp_level) if acp_level else None
-        request.state.acp_budget = int(acp_budget) if acp_budget else None
-
-        response = await call_next(request)
-        return response
 
-    return acp_middleware
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # One pass over the raw headers; the first occurrence of each wins
+        raw_level = raw_budget = None
+        for name, value in scope["headers"]:
+            if name == _ACP_LEVEL:
+                if raw_level is None:
+                    raw_level = value
+            elif name == _ACP_BUDGET:
+                if raw_budget is None:
+                    raw_budget = value
+            else:
+                continue
+            if raw_level is not None and raw_budget is not None:
+                break
+
+        # Starlette's request.state reads from scope["state"]
+        state = scope.setdefault("state", {})
+        state["acp_level"] = _parse_small_int(raw_level)
+        state["acp_budget"] = _parse_small_int(raw_budget)
+
+        await self.app(scope, receive, send)
+
+
+def _parse_small_int(value: bytes | None) -> int | None:
+    """Parse a non-negative integer header value, or None if absent or malformed."""
+    if not value or len(value) > _MAX_HEADER_DIGITS:
+        return None
+    n = 0
+    for ch in value:
+        digit = ch - 0x30  # ord("0")
+        if not 0 <= digit <= 9:
+            return None
+        n = n * 10 + digit
+    return n
@@ -2,6 +2,8 @@
 Tests for ACP library.
 """
 
+import asyncio
+import functools
 import json
 import pytest
 
@@ -138,6 +140,10 @@ class TestACPDocument:
         assert doc.get(level=0) == "exists"
         assert doc.get(level=3) == user_data
 
+        for bad in (4, -1, 1.7, "1"):
+            with pytest.raises(ValueError):
+                doc.get(level=bad)
+
     def test_get_by_budget(self, user_data):
         doc = ACPDocument.from_dict(
             data=user_data,
@@ -153,6 +159,21 @@ class TestACPDocument:
         result = doc.get(token_budget=100)
         assert result != "exists"
 
+    def test_get_by_budget_reads_current_levels(self, user_data):
+        doc = ACPDocument.from_dict(
+            data=user_data,
+            entity="user",
+            id="user-123",
+        )
+
+        doc.l1 = "changed"
+        doc.token_counts = {"L0": 1, "L1": 2, "L2": 500, "L3": 1000}
+        assert doc.get(token_budget=2) == "changed"
+        assert doc.get(token_budget=1000) == user_data
+
+        doc.token_counts = {}
+        assert doc.get(token_budget=1000) == "exists"
+
     def test_token_counts(self, user_data):
         doc = ACPDocument.from_dict(
             data=user_data,
@@ -170,6 +191,65 @@ class TestACPDocument:
         assert doc.token_counts["L1"] < doc.token_counts["L2"]
         assert doc.token_counts["L2"] < doc.token_counts["L3"]
 
+    def test_calculate_tokens_batch(self, user_data, product_data):
+        expected = [
+            ACPDocument.from_dict(user_data, entity="user", id="user-123").token_counts,
+            ACPDocument.from_dict(product_data, entity="product", id="product-456").token_counts,
+        ]
+
+        docs = [
+            ACPDocument.from_dict(user_data, entity="user", id="user-123", auto_generate=False),
+            ACPDocument.from_dict(
+                product_data, entity="product", id="product-456", auto_generate=False
+            ),
+        ]
+        for doc in docs:
+            doc.generate_levels(count_tokens=False)
+            assert doc.token_counts == {}
+
+        ACPDocument.calculate_tokens_batch(docs)
+        assert [doc.token_counts for doc in docs] == expected
+
+    def test_calculate_tokens_batch_encoder(self, monkeypatch, user_data, product_data):
+        from acp import document
+
+        class FakeEncoder:
+            def __init__(self):
+                self.batches = []
+
+            def encode(self, text):
+                return text.split()
+
+            def encode_batch(self, texts, num_threads=1):
+                self.batches.append(texts)
+                return [self.encode(text) for text in texts]
+
+        encoder = FakeEncoder()
+        monkeypatch.setattr(document, "_get_encoder", lambda: encoder)
+        document._enc_len.cache_clear()
+        try:
+            expected = [
+                ACPDocument.from_dict(user_data, entity="user", id="user-123").token_counts,
+                ACPDocument.from_dict(product_data, entity="product", id="p-456").token_counts,
+            ]
+            docs = [
+                ACPDocument.from_dict(user_data, entity="user", id="user-123", auto_generate=False),
+                ACPDocument.from_dict(
+                    product_data, entity="product", id="p-456", auto_generate=False
+                ),
+            ]
+            for doc in docs:
+                doc.generate_levels(count_tokens=False)
+            ACPDocument.calculate_tokens_batch(docs)
+        finally:
+            document._enc_len.cache_clear()
+
+        # One batch holding L1-L3 of each document, in order
+        assert len(encoder.batches) == 1
+        assert len(encoder.batches[0]) == 6
+        assert [doc.token_counts for doc in docs] == expected
+        assert docs[0].token_counts["L1"] == len(docs[0].l1.split())
+
     def test_custom_key_fields(self, user_data):
         doc = ACPDocument.from_dict(
             data=user_data,
@@ -192,6 +272,24 @@ class TestACPDocument:
 
         assert doc.l1 == "Alice Chen (Senior Engineer)"
 
+    def test_summary_template_nested_fields(self, user_data):
+        doc = ACPDocument.from_dict(
+            data=user_data,
+            entity="user",
+            id="user-123",
+            summary_template="{name} in {location_office} ({timezone}) {missing}",
+        )
+
+        assert doc.l1 == "Alice Chen in San Francisco (America/Los_Angeles) {missing}"
+
+    def test_summary_template_nested_precedence(self):
+        data = {"name": "A", "owner": {"name": "B", "team": "T"}}
+
+        # {name} resolves the same way whatever else the template uses
+        gen = SchemaBasedGenerator()
+        assert gen.generate_l1(data, "project", "{name}") == "B"
+        assert gen.generate_l1(data, "project", "{name} {team}") == "B T"
+
     def test_to_acp_format(self, user_data):
         doc = ACPDocument.from_dict(
             data=user_data,
@@ -223,6 +321,46 @@ class TestACPDocument:
         assert parsed["entity"] == "user"
         assert "levels" in parsed
         assert parsed["levels"]["L0"] == "exists"
+        assert parsed["levels"]["L2"] == doc.l2
+        assert parsed["levels"]["L3"] == user_data
+        assert parsed["meta"]["tokens"] == doc.token_counts
+
+    def test_serialization_reflects_data_changes(self, user_data):
+        doc = ACPDocument.from_dict(
+            data=user_data,
+            entity="user",
+            id="user-123",
+        )
+        doc.to_json()
+
+        doc.data["status"] = "inactive"
+        assert doc.get(level=3)["status"] == "inactive"
+        assert json.loads(doc.to_json())["levels"]["L3"]["status"] == "inactive"
+        assert '"status": "inactive"' in doc.to_acp_format()
+
+    def test_to_json_keeps_non_finite_floats(self):
+        doc = ACPDocument.from_dict(
+            data={"name": "Sensor", "reading": float("nan"), "limits": [float("inf")]},
+            entity="device",
+            id="device-1",
+        )
+
+        l3 = json.loads(doc.to_json())["levels"]["L3"]
+        assert l3["reading"] != l3["reading"]
+        assert l3["limits"] == [float("inf")]
+
+    def test_generated_at_stamped_on_serialization(self, user_data):
+        doc = ACPDocument.from_dict(
+            data=user_data,
+            entity="user",
+            id="user-123",
+        )
+
+        assert doc.generated_at is None
+        first = json.loads(doc.to_json())["meta"]["generated"]
+        assert doc.generated_at is not None
+        assert first == doc.generated_at.isoformat()
+        assert f"generated: {first}" in doc.to_acp_format()
 
     def test_to_json_specific_level(self, user_data):
         doc = ACPDocument.from_dict(
@@ -255,6 +393,31 @@ class TestSchemaBasedGenerator:
 
         assert "Premium Headphones" in summary
 
+    def test_generate_l1_generic_order(self):
+        gen = SchemaBasedGenerator()
+        data = {"state": "CA", "status": "open", "title": "Ticket", "id": "t-1"}
+        summary = gen.generate_l1(data, "ticket")
+
+        # Generic fields follow HIGH_PRIORITY_ORDER; id is dropped when a title exists
+        assert summary == "Ticket, open, CA"
+
+    def test_generate_l1_nested_precedence(self):
+        gen = SchemaBasedGenerator()
+        data = {"name": "A", "role": "r", "department": "d", "status": "active",
+                "meta": {"status": "x"}}
+
+        # A nested key wins over the top-level one whether or not every
+        # priority field is present
+        assert gen.generate_l1(data, "user") == "A, r, d, x"
+        del data["department"]
+        assert gen.generate_l1(data, "user") == "A, r, x"
+
+        # A dict name never reaches the flattened view, so the ID stays in
+        order = {"id": "o1", "name": {"first": "x"}, "status": "s", "total": 3, "user_id": "u"}
+        assert gen.generate_l1(order, "order") == "o1, s, 3, u"
+        txn = {"id": "t1", "title": {"text": "x"}, "type": "card", "amount": 3, "status": "ok"}
+        assert gen.generate_l1(txn, "transaction") == "t1, card, 3, ok"
+
     def test_generate_l2_user(self, user_data):
         gen = SchemaBasedGenerator()
         l2 = gen.generate_l2(user_data, "user")
@@ -308,6 +471,54 @@ class TestMCPIntegration:
         assert result.entity == "user"
         assert result.l0 == "exists"
 
+    def test_acp_resource_decorator_signatures(self):
+        from acp.mcp import acp_resource
+
+        @acp_resource(entity="user")
+        def get_user(str: str) -> dict:
+            """Fetch a user."""
+            return {"name": "Alice"}
+
+        @acp_resource(entity="order")
+        def get_order(order_id: str, expand: bool = False) -> dict:
+            return {"name": "Order", "expand": expand}
+
+        # Positional and keyword calls both work for single-argument handlers;
+        # only a positional argument stands in for a missing "id"
+        assert get_user("u-1").id == "u-1"
+        assert get_user(str="u-2").id == "unknown"
+        with pytest.raises(TypeError):
+            get_user("u-1", str="u-2")
+        assert get_user.__name__ == "get_user"
+        assert get_user.__doc__ == "Fetch a user."
+
+        assert get_order("o-1", expand=True).l3 == {"name": "Order", "expand": True}
+        assert get_order(order_id="o-2").id == "unknown"
+        assert get_order.__name__ == "get_order"
+
+        def keyword_only(func):
+            @functools.wraps(func)
+            def wrapper(**kwargs):
+                return func(**kwargs)
+            return wrapper
+
+        @acp_resource(entity="user")
+        @keyword_only
+        def get_wrapped_user(user_id: str) -> dict:
+            return {"id": user_id}
+
+        # The signature of a decorated handler is its wrapper's, not __wrapped__'s
+        assert get_wrapped_user(user_id="u-4").id == "u-4"
+
+        class Repo:
+            @acp_resource(entity="user")
+            def get_user(self, user_id: str) -> dict:
+                return {"id": user_id, "owner": type(self).__name__}
+
+        doc = Repo().get_user("u-3")
+        assert doc.id == "u-3"
+        assert doc.l3["owner"] == "Repo"
+
     def test_acp_server(self, user_data):
         from acp.mcp import ACPServer
 
@@ -350,6 +561,214 @@ class TestMCPIntegration:
         )
         assert result == "exists"
 
+    def test_acp_server_l0_skips_handler(self):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+
+        @server.resource("user")
+        def get_user(user_id: str) -> dict:
+            raise AssertionError("handler should not be called")
+
+        assert server.handle_request(
+            "user", {"user_id": "123"}, level=ResolutionLevel.L0_EXISTENCE
+        ) == "exists"
+        assert server.handle_request("user", {"user_id": "123"}, level=0) == "exists"
+        with pytest.raises(ValueError):
+            server.handle_request("order", {"order_id": "1"}, level=0)
+
+    def test_acp_server_l0_does_not_check_store(self):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+        users = {"123": {"id": "123", "name": "Alice"}}
+
+        @server.resource("user")
+        def get_user(user_id: str) -> dict:
+            return users[user_id]
+
+        # L0 answers for any ID; only higher levels reach the store
+        assert server.handle_request("user", {"user_id": "999"}, level=0) == "exists"
+        with pytest.raises(KeyError):
+            server.handle_request("user", {"user_id": "999"}, level=1)
+
+    def test_acp_server_small_budget_fits_summary(self):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+
+        @server.resource("user")
+        def get_user(user_id: str) -> dict:
+            return {"id": user_id, "name": "Al"}
+
+        # A short L1 fits budgets inside L0's typical range
+        assert server.handle_request("user", {"user_id": "1"}, token_budget=2) == "Al"
+        assert server.handle_request("user", {"user_id": "1"}, token_budget=3) == "Al"
+
+    def test_acp_server_caches_documents(self, user_data):
+        from acp.mcp import ACPServer
+
+        server = ACPServer(cache_size=8)
+        calls = []
+
+        @server.resource("user")
+        def get_user(user_id) -> dict:
+            calls.append(user_id)
+            return user_data
+
+        server.handle_request("user", {"user_id": "123"}, level=ResolutionLevel.L1_SUMMARY)
+        server.handle_request("user", {"user_id": "123"}, level=ResolutionLevel.L3_FULL)
+        assert calls == ["123"]
+
+        server.handle_request("user", {"user_id": "456"})
+        assert calls == ["123", "456"]
+
+        server.invalidate("user")
+        server.handle_request("user", {"user_id": "123"})
+        assert calls == ["123", "456", "123"]
+
+        # Unhashable params bypass the cache
+        server.handle_request("user", {"user_id": ["123"]})
+        server.handle_request("user", {"user_id": ["123"]})
+        assert len(calls) == 5
+
+    def test_acp_server_cache_is_opt_in(self, user_data):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+        calls = []
+
+        @server.resource("user")
+        def get_user(user_id) -> dict:
+            calls.append(user_id)
+            return user_data
+
+        server.handle_request("user", {"user_id": "123"})
+        server.handle_request("user", {"user_id": "123"})
+        assert calls == ["123", "123"]
+
+    def test_acp_server_cached_levels_are_copies(self, user_data):
+        from acp.mcp import ACPServer
+
+        server = ACPServer(cache_size=8)
+
+        @server.resource("user")
+        def get_user(user_id) -> dict:
+            return user_data
+
+        full = server.handle_request("user", {"user_id": "123"}, level=ResolutionLevel.L3_FULL)
+        full["name"] = "Mallory"
+        full["location"]["office"] = "Nowhere"
+        facts = server.handle_request("user", {"user_id": "123"})
+        facts["role"] = "Intern"
+
+        again = server.handle_request("user", {"user_id": "123"}, level=ResolutionLevel.L3_FULL)
+        assert again["name"] == "Alice Chen"
+        assert again["location"]["office"] == "San Francisco"
+        assert server.handle_request("user", {"user_id": "123"})["role"] == "Senior Engineer"
+        assert user_data["name"] == "Alice Chen"
+
+    def test_acp_server_id_extraction(self, user_data):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+
+        @server.resource("user")
+        def get_user(user_id: str) -> dict:
+            return user_data
+
+        @server.resource("account", id_from_params="account_id")
+        def get_account(account_id: str) -> dict:
+            return user_data
+
+        @server.resource("profile", id_field="email")
+        def get_profile(user_id: str) -> dict:
+            return user_data
+
+        assert server.get_document("user", {"user_id": "123"}).id == "user-123"
+        assert server.get_document("account", {"account_id": "acct-9"}).id == "acct-9"
+        assert server.get_document("profile", {"user_id": "123"}).id == "alice@example.com"
+
+    def test_acp_server_handle_requests(self, user_data, product_data):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+
+        @server.resource("user")
+        def get_user(user_id: str) -> dict:
+            return user_data
+
+        @server.resource("product")
+        async def get_product(product_id: str) -> dict:
+            await asyncio.sleep(0)
+            return product_data
+
+        results = asyncio.run(server.handle_requests([
+            ("user", {"user_id": "123"}, ResolutionLevel.L2_KEY_FACTS, None),
+            ("product", {"product_id": "456"}, ResolutionLevel.L3_FULL, None),
+            ("product", {"product_id": "456"}, ResolutionLevel.L0_EXISTENCE, None),
+            ("user", {"user_id": "123"}, None, 5),
+        ]))
+
+        assert results[0]["name"] == "Alice Chen"
+        assert results[1] == product_data
+        assert results[2:] == ["exists", "exists"]
+
+    def test_acp_server_wrapped_handler(self):
+        from acp.mcp import ACPServer
+
+        server = ACPServer()
+
+        def keyword_only(func):
+            @functools.wraps(func)
+            def wrapper(**kwargs):
+                return func(**kwargs)
+            return wrapper
+
+        @server.resource("user")
+        @keyword_only
+        def get_user(user_id: str) -> dict:
+            return {"id": user_id, "name": "Alice"}
+
+        # Params reach the wrapper by keyword, as its own signature requires
+        assert server.handle_request("user", {"user_id": "1"}, level=1) == "Alice"
+        results = asyncio.run(server.handle_requests([
+            ("user", {"user_id": "1"}, ResolutionLevel.L1_SUMMARY, None),
+        ]))
+        assert results == ["Alice"]
+
+    def test_acp_header_middleware(self):
+        from acp.mcp.server import ACPHeaderMiddleware
+
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope)
+
+        middleware = ACPHeaderMiddleware(app)
+        http_scope = {
+            "type": "http",
+            "headers": [(b"host", b"example.com"), (b"acp-level", b"1"), (b"acp-budget", b"50")],
+        }
+        asyncio.run(middleware(http_scope, None, None))
+        assert seen[-1]["state"] == {"acp_level": 1, "acp_budget": 50}
+
+        asyncio.run(middleware({"type": "http", "headers": []}, None, None))
+        assert seen[-1]["state"] == {"acp_level": None, "acp_budget": None}
+
+        # Malformed values are ignored rather than failing the request
+        bad_scope = {"type": "http", "headers": [(b"acp-level", b"high"), (b"acp-budget", b"")]}
+        asyncio.run(middleware(bad_scope, None, None))
+        assert seen[-1]["state"] == {"acp_level": None, "acp_budget": None}
+
+        bad_scope = {"type": "http", "headers": [(b"acp-level", b"-1"), (b"acp-budget", b"9" * 20)]}
+        asyncio.run(middleware(bad_scope, None, None))
+        assert seen[-1]["state"] == {"acp_level": None, "acp_budget": None}
+
+        # Non-HTTP scopes pass through untouched
+        asyncio.run(middleware({"type": "lifespan"}, None, None))
+        assert "state" not in seen[-1]
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])